@@ -64,15 +64,15 @@ setup(
     classifiers=['Development Status :: 4 - Beta',
                  'License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)',
                  'Programming Language :: Python',
-                 'Programming Language :: Python :: 2',
-                 'Programming Language :: Python :: 2.7',
-                 'Programming Language :: Python :: 3.5',
+                 'Programming Language :: Python :: 3',
+                 'Programming Language :: Python :: 3.7',
                  'Programming Language :: Python :: Implementation :: PyPy',
                  'Intended Audience :: Developers',
                  ],
     extras_require={
         'testing': ['pytest'],
     },
+    python_requires='>=3.7',
     platforms=['Linux'],
     test_suite='tests.uplook',
     cmdclass={'test': PyTest},
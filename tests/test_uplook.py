@@ -28,6 +28,12 @@ from uplook import UpLook
 from uplook.errors import NoSuchLookupFunction, NoSuchValue, LookupFunctionError
 from random import randint
 import time
+import os
+import json
+import tempfile
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier, Event, Lock
 
 
 def dictLookup(key):
@@ -53,6 +59,11 @@ def getHello():
     return "hello"
 
 
+def getHello2(param):
+
+    return "hello"
+
+
 def randomNumber(min, max):
     return randint(min, max)
 
@@ -61,6 +72,16 @@ def getTime():
     return time.time()
 
 
+def treeLookup(prefix):
+
+    values = {"app/db/": {"host": "localhost", "credentials": {"user": "admin"}}}
+
+    try:
+        return values[prefix]
+    except KeyError:
+        raise NoSuchValue("%s does not return any value" % (prefix))
+
+
 def badLookup():
     raise Exception("I'm a bad lookupfunction")
 
@@ -213,6 +234,13 @@ class TestUplook(unittest.TestCase):
         u = UpLook(one="een", two="twee", three=None)
         self.assertEqual(u.dump(), {"one": "een", "two": "twee", "three": None})
 
+    def test_methodDumpKeepsKeyOrder(self):
+
+        u = UpLook(one='~~lookup()', two=2, three={"four": '~~lookup()', "five": 5})
+        u.registerLookup("lookup", getHello)
+        self.assertEqual(list(u.dump()), ["one", "two", "three"])
+        self.assertEqual(list(u.dump()["three"]), ["four", "five"])
+
     def test_methodDumpWithoutNone(self):
 
         u = UpLook(one="een", two="twee", three=None)
@@ -323,6 +351,387 @@ class TestUplook(unittest.TestCase):
         db["one)"] = "fubar"
         self.assertEqual(u.value.one, "fubar")
 
+    def test_methodReload(self):
+
+        calls = []
+
+        def getLookup(key):
+            calls.append(key)
+            return dictLookup(key)
+
+        u = UpLook(one='~lookup("one")', data={"two": '~lookup("two")'}, three=3)
+        u.registerLookup("lookup", getLookup)
+        calls[:] = []
+        u.reload(one='~lookup("one")', data={"two": '~lookup("three")'}, four=4)
+        self.assertEqual(calls, ["three"])
+        self.assertEqual(u.dump(), {"one": "een", "data": {"two": "drie"}, "four": 4})
+
+    def test_methodReloadKeepsFunctionsUntilDone(self):
+
+        seen = []
+
+        def getLookup(key):
+            seen.append(list(u.listFunctions()))
+            return dictLookup(key)
+
+        u = UpLook(one='~lookup("one")')
+        u.registerLookup("lookup", getLookup)
+        u.registerLookup("other", getLookup)
+        seen[:] = []
+        u.reload(one='~other("one")')
+        self.assertEqual(seen, [["lookup"]])
+        self.assertEqual(list(u.listFunctions()), ["other"])
+
+    def test_methodReloadAfterChangingNestedDictInPlace(self):
+
+        config = {"data": {"one": '~lookup("one")'}}
+        u = UpLook(**config)
+        u.registerLookup("lookup", dictLookup)
+        config["data"]["one"] = '~lookup("two")'
+        u.reload(**config)
+        self.assertEqual(u.dump(), {"data": {"one": "twee"}})
+
+    def test_methodReloadFailureKeepsValues(self):
+
+        u = UpLook(one='~lookup("one")')
+        u.registerLookup("lookup", dictLookup)
+        u.registerLookup("bad", badLookup)
+        self.assertRaises(LookupFunctionError, u.reload, one='~bad()')
+        self.assertEqual(u.value.one, "een")
+        self.assertEqual(list(u.listFunctions()), ["lookup"])
+
+    def test_methodLayered(self):
+
+        calls = []
+
+        def getLookup(key):
+            calls.append(key)
+            return dictLookup(key)
+
+        defaults = {"one": '~lookup("one")', "data": {"two": 2, "three": 3}}
+        overrides = {"one": "override", "data": {"three": '~lookup("three")'}}
+        u = UpLook.layered(defaults, overrides)
+        u.registerLookup("lookup", getLookup)
+        self.assertEqual(calls, ["three"])
+        self.assertEqual(u.dump(), {"one": "override", "data": {"two": 2, "three": "drie"}})
+        self.assertEqual(u.getOrigin("data.two"), 0)
+        self.assertEqual(u.getOrigin("data.three"), 1)
+        self.assertEqual(defaults, {"one": '~lookup("one")', "data": {"two": 2, "three": 3}})
+
+    def test_methodUpdateLayerChangedInPlace(self):
+
+        defaults = {"data": {"one": 1}}
+        env = {"data": {"two": '~lookup("one")'}, "three": {"four": '~lookup("one")'}}
+        u = UpLook.layered(defaults, env)
+        u.registerLookup("lookup", dictLookup)
+        env["data"]["two"] = '~lookup("two")'
+        env["three"]["four"] = '~lookup("three")'
+        u.updateLayer(0, {"data": {"one": 2}})
+        self.assertEqual(u.dump(), {"data": {"one": 2, "two": "een"}, "three": {"four": "een"}})
+        u.updateLayer(1, env)
+        self.assertEqual(u.dump(), {"data": {"one": 2, "two": "twee"}, "three": {"four": "drie"}})
+
+    def test_methodUpdateLayer(self):
+
+        u = UpLook.layered({"one": '~lookup("one")', "two": 2}, {"two": 3})
+        u.registerLookup("lookup", dictLookup)
+        u.updateLayer(1, {"one": '~lookup("two")'})
+        self.assertEqual(u.dump(), {"one": "twee", "two": 2})
+        self.assertEqual(u.getOrigin("one"), 1)
+        self.assertEqual(u.getOrigin("two"), 0)
+        self.assertRaises(NoSuchValue, u.getOrigin, "three")
+
+    def test_builtinFileLookup(self):
+
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".txt") as f:
+            f.write("secret\n")
+            f.flush()
+            u = UpLook(one='~~file("%s")' % (f.name), two='~~file("/does/not/exist", "default")')
+            self.assertEqual(u.value.one, "secret")
+            self.assertEqual(u.value.two, "default")
+            with open(f.name, "w") as g:
+                g.write("other secret")
+            self.assertEqual(u.value.one, "other secret")
+
+    def test_builtinJSONLookup(self):
+
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".json") as f:
+            json.dump({"db": {"hosts": ["one", "two"]}}, f)
+            f.flush()
+            u = UpLook(one='~json("%s#db.hosts.1")' % (f.name),
+                       two='~json("%s#db.port", 5432)' % (f.name),
+                       three='~json("%s")' % (f.name))
+            self.assertEqual(u.value.one, "two")
+            self.assertEqual(u.value.two, 5432)
+            self.assertEqual(u.value.three, {"db": {"hosts": ["one", "two"]}})
+
+    def test_builtinEnvLookup(self):
+
+        with patch.dict(os.environ, {"UPLOOK_TEST": "een"}):
+            u = UpLook(one='~env("UPLOOK_TEST")', two='~env("UPLOOK_TEST_UNSET", "twee")')
+        self.assertEqual(u.value.one, "een")
+        self.assertEqual(u.value.two, "twee")
+
+    def test_getStaticTreeLookup(self):
+
+        calls = []
+
+        def getTree(prefix):
+            calls.append(prefix)
+            return treeLookup(prefix)
+
+        u = UpLook(db='~consul.tree("app/db/")', other='~consul.tree("app/other/", {})')
+        u.registerLookup("consul.tree", getTree)
+        self.assertEqual(calls, ["app/db/", "app/other/"])
+        self.assertEqual(u.value.db, {"host": "localhost", "credentials": {"user": "admin"}})
+        self.assertEqual(u.value.other, {})
+        self.assertEqual(u.dump()["db"]["credentials"]["user"], "admin")
+        self.assertEqual(list(u.listFunctions()), ["consul.tree"])
+
+    def test_getDynamicTreeLookup(self):
+
+        db = {"host": "localhost"}
+
+        def getTree(prefix):
+            return db
+
+        u = UpLook(db='~~consul.tree("app/db/")')
+        u.registerLookup("consul.tree", getTree)
+        self.assertEqual(u.value.db, {"host": "localhost"})
+        db["host"] = "remote"
+        self.assertEqual(u.dump(), {"db": {"host": "remote"}})
+
+    def test_badTreeLookupFunction(self):
+
+        u = UpLook(db='~~consul.tree("app/db/")')
+        u.registerLookup("consul.tree", getHello2)
+        self.assertRaises(LookupFunctionError, getattr, u.value, "db")
+
+    def test_missingTreeWithoutDefault(self):
+
+        u = UpLook(db='~~consul.tree("app/other/")')
+        u.registerLookup("consul.tree", treeLookup)
+        self.assertRaises(NoSuchValue, getattr, u.value, "db")
+
+        u = UpLook(db='~consul.tree("app/other/")')
+        self.assertRaises(NoSuchValue, u.registerLookup, "consul.tree", treeLookup)
+
+    def test_processExecutor(self):
+
+        u = UpLook(one='~lookup("one")', two='~~lookup("two")', three='~lookup("four", "default")')
+        u.registerLookup("lookup", dictLookup, executor="process")
+        self.assertEqual(u.dump(), {"one": "een", "two": "twee", "three": "default"})
+
+    def test_processExecutorUnpicklableFunction(self):
+
+        u = UpLook(one='~lookup("one")')
+        self.assertRaisesRegex(Exception, "can not be pickled", u.registerLookup, "lookup", lambda key: key, executor="process")
+        self.assertEqual(list(u.listFunctions()), ["lookup"])
+
+    def test_staticLookupsOnExecutorRunConcurrently(self):
+
+        barrier = Barrier(3, timeout=5)
+
+        def getLookup(key):
+            barrier.wait()
+            return dictLookup(key)
+
+        u = UpLook(one='~lookup("one")', data={"two": '~lookup("two")', "three": '~lookup("three")'})
+        u.registerLookup("lookup", getLookup, executor=ThreadPoolExecutor(max_workers=3))
+        self.assertEqual(u.dump(), {"one": "een", "data": {"two": "twee", "three": "drie"}})
+
+    def test_methodScope(self):
+
+        calls = []
+
+        def getLookup(key):
+            calls.append(key)
+            return len(calls)
+
+        u = UpLook(one='~~lookup("one")', two='~~lookup("two")')
+        u.registerLookup("lookup", getLookup)
+        with u.scope():
+            self.assertEqual(u.value.one, 1)
+            self.assertEqual(u.dump(), {"one": 1, "two": 2})
+            with u.scope():
+                self.assertEqual(u.value.two, 2)
+        self.assertEqual(calls, ["one", "two"])
+        self.assertEqual(u.value.one, 3)
+
+    def test_methodScopeTreeLookup(self):
+
+        u = UpLook(db='~~consul.tree("app/db/")')
+        u.registerLookup("consul.tree", treeLookup)
+        with u.scope():
+            u.value.db["host"] = "remote"
+            u.value.db["credentials"]["user"] = "root"
+            self.assertEqual(u.value.db, {"host": "localhost", "credentials": {"user": "admin"}})
+
+    def test_methodScopeOtherInstance(self):
+
+        u = UpLook(one='~~lookup()')
+        u.registerLookup("lookup", getUUID)
+        other = UpLook()
+        with other.scope():
+            self.assertNotEqual(u.value.one, u.value.one)
+
+    def test_methodTrace(self):
+
+        u = UpLook(one='~~lookup("one")', data={"two": '~~lookup("four", "default")'}, three='~~bad()')
+        u.registerLookup("lookup", dictLookup)
+        u.registerLookup("bad", badLookup)
+        with u.scope():
+            with u.trace() as t:
+                for _ in range(3):
+                    u.value.one
+                self.assertEqual(u.value.data, {"two": "default"})
+                self.assertRaises(Exception, getattr, u.value, "three")
+        u.value.one
+
+        self.assertEqual([(r.path, r.function, r.reference, r.outcome) for r in t.records],
+                         [("one", "lookup", "one", "value"),
+                          ("one", "lookup", "one", "cache"),
+                          ("one", "lookup", "one", "cache"),
+                          ("data.two", "lookup", "four", "default"),
+                          ("three", "bad", None, "error")])
+        self.assertEqual(t.records[0].caller[0], __file__)
+        report = t.report()
+        self.assertEqual(report[0].count, 3)
+        self.assertEqual(report[0].paths, ["one"])
+
+    def test_methodTraceNested(self):
+
+        u = UpLook(one='~~lookup("one")')
+        u.registerLookup("lookup", dictLookup)
+        with u.trace() as outer:
+            u.value.one
+            with u.trace() as inner:
+                u.value.one
+        self.assertEqual(len(outer.records), 2)
+        self.assertEqual(len(inner.records), 1)
+
+    def test_hintLatencyRunsSlowLookupsConcurrently(self):
+
+        done = Event()
+
+        def getSlow(key):
+            if not done.wait(5):
+                raise Exception("cheap lookup did not run concurrently")
+            return dictLookup(key)
+
+        def getCheap(key):
+            done.set()
+            return dictLookup(key)
+
+        u = UpLook(one='~slow("one")', two='~cheap("two")')
+        u.registerLookup("cheap", getCheap)
+        u.registerLookup("slow", getSlow, latency=1)
+        self.assertEqual(u.dump(), {"one": "een", "two": "twee"})
+
+    def test_hintLatencyOrdersInlineLookups(self):
+
+        calls = []
+
+        def getLookup(key):
+            calls.append(key)
+            return dictLookup(key)
+
+        u = UpLook(one='~slower("one")', two='~slow("two")', three='~fast("three")')
+        u.registerLookup("slower", getLookup, latency=0.005)
+        u.registerLookup("slow", getLookup, latency=0.001)
+        u.registerLookup("fast", getLookup)
+        self.assertEqual(calls[-3:], ["three", "two", "one"])
+
+    def test_hintBatch(self):
+
+        calls = []
+
+        def getBatch(keys):
+            calls.append(keys)
+            return [dictLookup(key) if key != "four" else NoSuchValue() for key in keys]
+
+        u = UpLook(one='~lookup("one")', data={"two": '~lookup("two")', "four": '~lookup("four", "default")'},
+                   three='~~lookup("three")', five='~~lookup("four", "default")')
+        u.registerLookup("lookup", getBatch, batch=True)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(calls[0]), ["four", "one", "two"])
+        self.assertEqual(u.value.three, "drie")
+        self.assertEqual(calls[-1], ["three"])
+        self.assertEqual(u.dump(), {"one": "een", "data": {"two": "twee", "four": "default"}, "three": "drie", "five": "default"})
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sorted(calls[-1]), ["four", "three"])
+
+    def test_hintPure(self):
+
+        calls = []
+
+        def getLookup(key):
+            calls.append(key)
+            return dictLookup(key)
+
+        u = UpLook(one='~lookup("one")', data={"one": '~lookup("one")'}, two='~~lookup("two")', three='~~lookup("two")')
+        u.registerLookup("lookup", getLookup, pure=True)
+        self.assertEqual(calls, ["one"])
+        self.assertEqual(u.dump(), {"one": "een", "data": {"one": "een"}, "two": "twee", "three": "twee"})
+        self.assertEqual(calls, ["one", "two"])
+
+    def test_hintBatchDumpKeepsScopeAndTrace(self):
+
+        calls = []
+
+        def getBatch(keys):
+            calls.append(keys)
+            return [dictLookup(key) for key in keys]
+
+        u = UpLook(one='~~lookup("one")', two='~~lookup("two")', three='~~lookup("three")')
+        u.registerLookup("lookup", getBatch, batch=True)
+        with u.scope():
+            with u.trace() as t:
+                self.assertEqual(u.value.one, "een")
+                self.assertEqual(u.dump(), {"one": "een", "two": "twee", "three": "drie"})
+                self.assertEqual(u.dump(), {"one": "een", "two": "twee", "three": "drie"})
+        self.assertEqual(calls, [["one"], ["two", "three"]])
+        self.assertEqual([r.outcome for r in t.records], ["value", "cache", "value", "value", "cache", "cache", "cache"])
+        self.assertEqual(set(r.caller[0] for r in t.records), set([__file__]))
+
+    def test_hintConcurrency(self):
+
+        lock = Lock()
+        active = []
+        maximum = []
+
+        def getLookup(key):
+            with lock:
+                active.append(key)
+                maximum.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.remove(key)
+            return dictLookup(key)
+
+        u = UpLook(one='~lookup("one")', two='~lookup("two")', three='~lookup("three")', four='~~lookup("one")', five='~~lookup("two")')
+        u.registerLookup("lookup", getLookup, latency=1, concurrency=2)
+        self.assertEqual(max(maximum), 2)
+        self.assertEqual(u.dump(), {"one": "een", "two": "twee", "three": "drie", "four": "een", "five": "twee"})
+        self.assertEqual(max(maximum), 2)
+
+    def test_hintLatencyDumpKeepsScopeAndTrace(self):
+
+        barrier = Barrier(2, timeout=5)
+
+        def getLookup(key):
+            barrier.wait()
+            return dictLookup(key)
+
+        u = UpLook(one='~~lookup("one")', two='~~lookup("two")')
+        u.registerLookup("lookup", getLookup, latency=1)
+        with u.scope():
+            with u.trace() as t:
+                self.assertEqual(u.dump(), {"one": "een", "two": "twee"})
+                self.assertEqual(u.value.one, "een")
+        self.assertEqual(sorted(r.outcome for r in t.records), ["cache", "value", "value"])
+        self.assertEqual(set(r.caller[0] for r in t.records), set([__file__]))
+
 
 def main():
     unittest.main()
@@ -23,15 +23,50 @@
 #
 
 import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from .errors import NoSuchValue, NoSuchLookupFunction, LookupFunctionError
+from .providers import BUILTIN_LOOKUPS
+from .executors import getExecutor, checkFunction
+from .trace import Trace
+from .planner import Hints, DEFAULT_HINTS, plan, unpackBatch
 import json
 
+# Maps the id of an UpLook instance to the dynamic values memoized within its
+# current scope.
+scopes = ContextVar("uplook_scopes", default={})
+
+# Maps the id of an UpLook instance to the active Traces recording its
+# dynamic lookups.
+tracers = ContextVar("uplook_tracers", default={})
+
 
 class Undef(object):
     def __init__(self, name=None):
         self.name = name
 
 
+class Pending(object):
+
+    """
+    A static lookup which still has to be executed.
+
+    :param function: The function's reference name.
+    :type function: str or unicode
+    :param args: The arguments to call the function with.
+    :type args: tuple
+    :param finish: Converts a function returning the result of the lookup
+                   function into the final value.
+    :type finish: function
+    """
+
+    def __init__(self, function, args, finish):
+        self.function = function
+        self.args = args
+        self.finish = finish
+
+
 class Container(object):
 
     def __init__(self, **kwargs):
@@ -48,7 +83,8 @@ class Container(object):
             if isinstance(value, Undef):
                 raise NoSuchLookupFunction("There is no function with name '%s'" % (value.name))
             if isinstance(value, Container):
-                return dict(value)
+                # dict(value) would look for a keys attribute which raises NoSuchValue.
+                return dict(iter(value))
             elif hasattr(value, '__call__'):
                 return value()
             else:
@@ -73,10 +109,10 @@ class Container(object):
     def __iter__(self):
 
         for key, value in self.__dict__.items():
-            if hasattr(value, '__call__'):
+            if isinstance(value, Container):
+                yield key, dict(iter(value))
+            elif hasattr(value, '__call__'):
                 yield key, value()
-            elif isinstance(value, Container):
-                yield key, dict(value)
             else:
                 yield key, value
 
@@ -96,11 +132,21 @@ class UpLook(object):
         ~<name>(<variable>, <default_value>)
         ~~<name>(<variable>, <default_value>)
 
+    Lookup functions registered with a name ending in ".tree" return a
+    mapping which is converted into a nested Container.  When they fail and
+    no default value is set, the error is raised:
+
+        ~<name>.tree(<variable>, <default_value>)
+        ~~<name>.tree(<variable>, <default_value>)
+
     Default values are returned when executing the function raises an
     uplook.errors.NoSuchValue Exception.
 
     Values are accessible under <self.value>.
 
+    The lookup functions "file", "json" and "env" are available without
+    registering them.  See uplook.providers.
+
     """
 
     __lock = False
@@ -108,56 +154,219 @@ class UpLook(object):
     def __init__(self, **kwargs):
 
         self.__lock = False
+        kwargs = self.__copyDicts(kwargs)
         self.__kwargs = kwargs
-        self.__lookup = {}
+        self.__layers = [kwargs]
+        self.__origin = self.__mergeLayers(self.__layers)[1]
+        self.__lookup = dict(BUILTIN_LOOKUPS)
+        self.__executors = {}
+        self.__hints = {}
         self.__user_defined_functions = []
 
-        self.value = self.__processKwargs(kwargs)
+        self.value = self.__build(kwargs, self.__user_defined_functions)
         self.__lock = True
 
-    def __processKwargs(self, kwargs):
+    @classmethod
+    def layered(cls, *layers):
+
+        """
+        Returns an UpLook instance initiated with the merged result of one or
+        more layers of keyword arguments.
+
+        Layers are merged in the provided order so later layers take
+        precedence over earlier ones.  Dict values are merged recursively, any
+        other value replaces the value of the earlier layers.  Lookup
+        definitions are only resolved when they end up in the merged result.
+
+        :param layers: One or more dicts.
+        :type layers: dict
+        :rtype: UpLook
+        """
+
+        instance = cls()
+        instance.updateLayers(*layers)
+        return instance
+
+    def __mergeLayers(self, layers):
+
+        """
+        Merges <layers> into a new dict without modifying any of the layers.
+
+        Only dicts which actually need merging are copied, all other values
+        are referenced as is.
+
+        :param layers: list of dicts
+        :rtype: tuple (merged dict, dict mapping each dotted path to the
+                index of the layer providing it)
+        """
+
+        def index(origin, layer, number):
+
+            for key, value in layer.items():
+                if isinstance(value, dict):
+                    origin[key] = (number, index({}, value, number))
+                else:
+                    origin[key] = (number, {})
+            return origin
+
+        def merge(result, origin, layer, number):
+
+            for key, value in layer.items():
+                if isinstance(value, dict) and isinstance(result.get(key), dict):
+                    result[key] = merge(dict(result[key]), origin[key][1], value, number)
+                    origin[key] = (number, origin[key][1])
+                elif isinstance(value, dict):
+                    result[key] = value
+                    origin[key] = (number, index({}, value, number))
+                else:
+                    result[key] = value
+                    origin[key] = (number, {})
+            return result
+
+        def flatten(result, origin, path):
+
+            for key, (number, children) in origin.items():
+                result[path + key] = number
+                flatten(result, children, path + key + ".")
+            return result
+
+        result = {}
+        origin = {}
+        for number, layer in enumerate(layers):
+            result = merge(result, origin, layer, number)
+
+        return result, flatten({}, origin, "")
+
+    def __build(self, kwargs, functions, previous_kwargs=None, previous=None):
+
+        """
+        Returns a Container with all lookup definitions of <kwargs> resolved.
+
+        Static lookups are collected while building the Container and then
+        executed at once as planned by uplook.planner.plan.
+
+        :param kwargs: dict
+        :param functions: See __processKwargs
+        :param previous_kwargs: See __processKwargs
+        :param previous: See __processKwargs
+        :rtype: Container
+        """
+
+        def collect(container):
+
+            for key, value in container.__dict__.items():
+                if isinstance(value, Pending):
+                    pending.append((container, key, value))
+                elif isinstance(value, Container):
+                    collect(value)
+
+        pending = []
+        container = self.__processKwargs(kwargs, functions, previous_kwargs, previous)
+        collect(container)
+
+        jobs = [(value.function, value.args) for _, _, value in pending]
+        outcomes = plan(jobs, self.__hints, self.__callLookup, self.__executors)
+        for (parent, key, value), outcome in zip(pending, outcomes):
+            parent.__dict__[key] = value.finish(outcome.get)
+
+        return container
+
+    def __processKwargs(self, kwargs, functions, previous_kwargs=None, previous=None, path=""):
 
         """
         Replaces any keyword arguments lookup definition value with the value.
 
+        When <previous_kwargs> and <previous> are provided, lookup definitions
+        which did not change compared to <previous_kwargs> reuse the value
+        already resolved in <previous> instead of being resolved again.
+
         :param kwargs: dict
+        :param functions: The list to add the names of the used lookup functions to.
+        :type functions: list
+        :param previous_kwargs: The kwargs <previous> was built from.
+        :type previous_kwargs: dict
+        :param previous: The Container built from <previous_kwargs>.
+        :type previous: Container
+        :param path: The dotted path prefix of <kwargs>.
+        :type path: str or unicode
         :rtype: dict
         """
 
+        if not isinstance(previous_kwargs, dict) or not isinstance(previous, Container):
+            previous_kwargs = {}
+            previous = Container()
+
         result = {}
         for key, value in kwargs.items():
+            old_value = previous_kwargs.get(key)
+            old_node = previous.__dict__.get(key)
             if isinstance(value, dict) and value != {}:
-                value = self.__processKwargs(value)
+                value = self.__processKwargs(value, functions, old_value, old_node, path + key + ".")
             elif isinstance(value, str) or isinstance(value, str):
-                value = self.__replaceLookup(value)
+                m = self.__parseLookup(value)
+                if m is not None and old_value == value and key in previous.__dict__:
+                    self.__registerFunctionName(functions, m["function"])
+                    value = old_node
+                else:
+                    value = self.__replaceLookup(value, path + key, functions)
 
             result[key] = value
 
         return Container(**result)
 
-    def __replaceLookup(self, value):
+    def __parseLookup(self, value):
 
         """
-        Takes a string/unicode and if it matches a lookup definition, return its value
+        Takes a string/unicode and if it matches a lookup definition, returns
+        its parts.
 
         :param value: string or unicode
-        :rtype: string
+        :rtype: dict or None
         """
 
         try:
-            m = re.match('(?P<type>~~?)\s?(?P<function>\w+?)\s?\((?P<ref>.*?)\)$', value)
+            m = re.match('(?P<type>~~?)\s?(?P<function>\w+?(?P<tree>\.tree)?)\s?\((?P<ref>.*?)\)$', value)
         except Exception:
-            return value
+            return None
 
         if m is None:
-            return value
+            return None
         else:
-            m = m.groupdict()
+            return m.groupdict()
+
+    def __registerFunctionName(self, functions, function):
+
+        """
+        Adds <function> to the list of user defined functions <functions>.
+
+        :param functions: list
+        :param function: The reference name of the function.
+        :type function: str or unicode
+        """
+
+        if function not in functions:
+            functions.append(function)
+
+    def __replaceLookup(self, value, path, functions):
+
+        """
+        Takes a string/unicode and if it matches a lookup definition, return its value
+
+        :param value: string or unicode
+        :param path: The dotted path of the value.
+        :type path: str or unicode
+        :param functions: See __processKwargs
+        :rtype: string
+        """
+
+        m = self.__parseLookup(value)
+
+        if m is None:
+            return value
 
         m["ref"] = m["ref"].lstrip().rstrip()
 
-        if m["function"] not in self.__user_defined_functions:
-            self.__user_defined_functions.append(m["function"])
+        self.__registerFunctionName(functions, m["function"])
 
         if self.__checkFunctionExists(m["function"]):
             if m["ref"] is None or m["ref"] == "":
@@ -166,13 +375,79 @@ class UpLook(object):
             else:
                 ref, default = self.__processRef(m["ref"])
 
-            if m["type"] == "~":
+            # A tree lookup without default raises the error of the lookup
+            # function instead of turning into a None subtree.
+            if m["tree"] and default is None:
+                default = Undef()
+
+            if m["type"] == "~" and m["tree"]:
+                value = self.__generateStaticLookup(m["function"], ref, default)
+                return Pending(value.function, value.args, lambda call: self.__buildContainer(self.__checkTree(m["function"], value.finish(call))))
+            elif m["type"] == "~":
                 return self.__generateStaticLookup(m["function"], ref, default)
+            elif m["type"] == "~~" and m["tree"]:
+                return self.__generateDynamicTreeLookup(m["function"], ref, default, path)
             elif m["type"] == "~~":
-                return self.__generateDynamicLookup(m["function"], ref, default)
+                return self.__generateDynamicLookup(m["function"], ref, default, path)
         else:
             return Undef(m["function"])
 
+    def __copyDicts(self, data):
+
+        """
+        Returns a copy of the (nested) dict <data>.  Only the dicts are
+        copied, all other values are referenced as is.
+
+        Kwargs and layers are compared against this copy on reload so changes
+        the caller makes in place to its own dicts are detected.
+
+        :param data: dict
+        :rtype: dict
+        """
+
+        result = {}
+        for key, value in data.items():
+            if isinstance(value, dict):
+                value = self.__copyDicts(value)
+            result[key] = value
+
+        return result
+
+    def __buildContainer(self, data):
+
+        """
+        Converts a (nested) dict into a (nested) Container without
+        interpreting any lookup definitions.
+
+        :param data: dict
+        :rtype: Container
+        """
+
+        result = {}
+        for key, value in data.items():
+            if isinstance(value, dict) and value != {}:
+                value = self.__buildContainer(value)
+            result[key] = value
+
+        return Container(**result)
+
+    def __checkTree(self, function, value):
+
+        """
+        Verifies whether the value returned by tree lookup <function> is a
+        mapping.
+
+        :param function: The reference name of the function.
+        :type function: str or unicode
+        :param value: The value returned by the lookup function.
+        :rtype: dict
+        """
+
+        if isinstance(value, dict):
+            return value
+        else:
+            raise LookupFunctionError("Tree lookup function '%s' did not return a dict but '%s'." % (function, type(value).__name__))
+
     def __checkFunctionExists(self, function):
 
         """
@@ -188,61 +463,186 @@ class UpLook(object):
         else:
             return False
 
-    def __generateDynamicLookup(self, function, reference, default):
+    def __callLookup(self, function, *args):
+
+        """
+        Executes lookup function <function> with <args> on the executor it
+        has been registered with.
+
+        :param function: The reference name of the function.
+        :type function: str or unicode
+        :param args: The arguments to call the function with.
+        """
+
+        executor = self.__executors.get(function)
+        if executor is None:
+            return self.__lookup[function](*args)
+        else:
+            return executor.submit(self.__lookup[function], *args).result()
+
+    def __generateDynamicLookup(self, function, reference, default, path):
 
         """
         Returns a function which executes the registered lookup function.
 
+        The returned function optionally takes a function returning the
+        result of the lookup function and the latency it took, so dump() can
+        plan the calls itself.  Its attributes <function>, <args> and
+        <cached> return the function's reference name, the arguments to call
+        it with and whether the value is memoized within the current scope.
+
         :param functions: The function's reference name.
         :type functions: str or unicode
         :param reference: The variable name for which a lookup needs to be done.
         :type reference: str or unicode
         :param default: The default value to return when the lookup returns NoSuchValue
+        :param path: The dotted path of the value.
+        :type path: str or unicode
         :rtype: function
         """
 
-        def lookupNoRef():
-            return self.__lookup[function]()
+        def callFunction():
+            if isinstance(reference, Undef):
+                return self.__callLookup(function)
+            elif self.__hints.get(function, DEFAULT_HINTS).batch:
+                return unpackBatch(function, self.__callLookup(function, [reference]), 1)[0].get()
+            else:
+                return self.__callLookup(function, reference)
+
+        def lookupNoRef(call):
+            return call(), "value"
 
-        def lookupRef():
+        def lookupRef(call):
             try:
-                return self.__lookup[function](reference)
+                return call(), "value"
             except NoSuchValue:
                 if isinstance(default, Undef):
                     raise NoSuchValue("'%s' does not return any value." % (reference))
                 else:
-                    return default
+                    return default, "default"
             except Exception as err:
                 if isinstance(default, Undef):
                     raise LookupFunctionError("Executing lookup function '%s' returns an error and no default value set. Reason: %s." % (reference, err))
                 else:
-                    return default
+                    return default, "default"
+
+        if isinstance(reference, Undef):
+            lookup = lookupNoRef
+        else:
+            lookup = lookupRef
+
+        def lookupScoped(call):
+            cache = scopes.get().get(id(self))
+            if cache is None:
+                return lookup(call)
+            try:
+                return cache[lookup], "cache"
+            except KeyError:
+                value, outcome = lookup(call)
+                cache[lookup] = value
+                return value, outcome
+
+        def lookupTraced(call=callFunction, latency=None):
+            traces = tracers.get().get(id(self))
+            if traces is None:
+                return lookupScoped(call)[0]
+
+            start = time.perf_counter()
+            try:
+                value, outcome = lookupScoped(call)
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                if latency is None or outcome == "cache":
+                    latency = time.perf_counter() - start
+                for trace in traces:
+                    trace.record(path, function, traced_reference, latency, outcome)
+            return value
+
+        def cached():
+            return lookup in scopes.get().get(id(self), {})
 
         if isinstance(reference, Undef):
-            return lookupNoRef
+            traced_reference = None
+            lookupTraced.args = ()
         else:
-            return lookupRef
+            traced_reference = reference
+            lookupTraced.args = (reference,)
+
+        lookupTraced.function = function
+        lookupTraced.cached = cached
+
+        return lookupTraced
+
+    def __generateDynamicTreeLookup(self, function, reference, default, path):
+
+        """
+        Returns a function which executes the registered tree lookup function
+        and returns the complete subtree at once.
+
+        :param functions: The function's reference name.
+        :type functions: str or unicode
+        :param reference: The prefix of the subtree to lookup.
+        :type reference: str or unicode
+        :param default: The default value to return when the lookup returns NoSuchValue
+        :param path: The dotted path of the value.
+        :type path: str or unicode
+        :rtype: function
+        """
+
+        lookup = self.__generateDynamicLookup(function, reference, default, path)
+
+        # A copy keeps changes made by the caller out of values memoized
+        # within a scope.
+        def lookupTree(*args):
+            return self.__copyDicts(self.__checkTree(function, lookup(*args)))
+
+        lookupTree.function = function
+        lookupTree.args = lookup.args
+        lookupTree.cached = lookup.cached
+        return lookupTree
 
     def __generateStaticLookup(self, function, reference, default):
         """
-        Executes the lookup function and returns its value
+        Returns a Pending value which executes the lookup function once
+        planned by __build.
 
         :param functions: The function's reference name.
         :type functions: str or unicode
         :param reference: The variable name for which a lookup needs to be done.
         :type reference: str or unicode
         :param default: The default value to return when the lookup returns NoSuchValue
+        :rtype: Pending
+        """
+
+        if isinstance(reference, Undef):
+            args = ()
+        else:
+            args = (reference,)
+
+        return Pending(function, args, lambda call: self.__executeStaticLookup(reference, default, call))
+
+    def __executeStaticLookup(self, reference, default, call):
+        """
+        Returns the result of <call> or the default value when it fails.
+
+        :param reference: The variable name for which a lookup needs to be done.
+        :type reference: str or unicode
+        :param default: The default value to return when the lookup returns NoSuchValue
+        :param call: A function returning the result of the lookup function.
+        :type call: function
         :rtype: str or unicode or int, float, ...
         """
 
         if isinstance(reference, Undef):
             try:
-                return self.__lookup[function]()
+                return call()
             except Exception as err:
                 raise LookupFunctionError("Failed to call the lookup function.  Reason: '%s'" % (err))
         else:
             try:
-                return self.__lookup[function](reference)
+                return call()
             except NoSuchValue:
                 if isinstance(default, Undef):
                     raise NoSuchValue("'%s' does not return any value." % (reference))
@@ -325,6 +725,9 @@ class UpLook(object):
         """
         Returns a dictionary of the current values.
 
+        Dynamic lookups which are not memoized within the current scope are
+        executed as planned by uplook.planner.plan.
+
         :param include_none: If <True> includes <None> values.
         :type include_none: bool
         :rtype: dict
@@ -338,12 +741,72 @@ class UpLook(object):
                 elif isinstance(value, Container):
                     result[key] = buildDict({}, value.__dict__)
                 elif hasattr(value, '__call__'):
-                    result[key] = value()
+                    # Keeps the key order until the value is known.
+                    result[key] = None
+                    dynamic.append((result, key, value))
                 else:
                     result[key] = value
             return result
 
-        return buildDict({}, self.value.__dict__)
+        dynamic = []
+        result = buildDict({}, self.value.__dict__)
+
+        planned = [index for index, (_, _, value) in enumerate(dynamic) if hasattr(value, "cached") and not value.cached()]
+        jobs = [(dynamic[index][2].function, dynamic[index][2].args) for index in planned]
+        outcomes = dict(zip(planned, plan(jobs, self.__hints, self.__callLookup, self.__executors)))
+
+        for index, (parent, key, value) in enumerate(dynamic):
+            if index in outcomes:
+                parent[key] = value(outcomes[index].get, outcomes[index].latency)
+            else:
+                parent[key] = value()
+
+        return result
+
+    @contextmanager
+    def scope(self):
+
+        """
+        Returns a context manager within which each dynamic lookup is
+        executed at most once.  The value it returns the first time is
+        returned on each access until the context manager exits.
+
+        Scopes apply to the current thread or asyncio task.  Nested scopes
+        keep the values of the outer scope.
+        """
+
+        current = scopes.get()
+        if id(self) in current:
+            yield
+            return
+
+        new = dict(current)
+        new[id(self)] = {}
+        token = scopes.set(new)
+        try:
+            yield
+        finally:
+            scopes.reset(token)
+
+    @contextmanager
+    def trace(self):
+
+        """
+        Returns a context manager yielding a uplook.trace.Trace which records
+        each dynamic lookup executed by accessing values or calling dump().
+
+        Tracing applies to the current thread or asyncio task.  Nested
+        traces all record the lookups executed within the inner one.
+        """
+
+        trace = Trace()
+        new = dict(tracers.get())
+        new[id(self)] = new.get(id(self), ()) + (trace,)
+        token = tracers.set(new)
+        try:
+            yield trace
+        finally:
+            tracers.reset(token)
 
     def get(self):
 
@@ -367,18 +830,120 @@ class UpLook(object):
         for key in self:
             yield (key, getattr(self.value, key))
 
-    def registerLookup(self, key, function, *args):
+    def registerLookup(self, key, function, *args, executor=None, latency=None, batch=False, concurrency=None, pure=False):
 
         """
         Registers <function> with name <key> so it can be used to perform static or dynamic lookups.
 
+        When <executor> is provided <function> is executed on it.  Static
+        lookups on an executor are resolved concurrently.  Functions executed
+        on the "process" executor and their results should be picklable.
+
+        The remaining arguments are hints used to plan the execution of
+        lookups when building the values and calling dump().  See
+        uplook.planner.plan.
+
         :param key: The reference name of the function.
         :type key: str or unicode
         :param function: The function to register.
         :type function: function
+        :param executor: "process", "thread" or a concurrent.futures.Executor
+        :type executor: str or concurrent.futures.Executor
+        :param latency: The expected number of seconds a call takes.
+        :type latency: float
+        :param batch: Whether <function> accepts a list of references and
+                      returns a list of values in the same order.
+        :type batch: bool
+        :param concurrency: The maximum number of concurrent calls.
+        :type concurrency: int
+        :param pure: Whether <function> is side-effect free.
+        :type pure: bool
         """
 
+        if executor is not None:
+            executor = getExecutor(executor)
+            checkFunction(executor, function)
+
+        if concurrency is not None and concurrency < 1:
+            raise Exception("concurrency should be 1 or higher.")
+
         self.__dict__["_UpLook__lock"] = False
         self.__dict__["_UpLook__lookup"][key] = function
-        self.value = self.__processKwargs(self.__kwargs)
+        if executor is None:
+            self.__dict__["_UpLook__executors"].pop(key, None)
+        else:
+            self.__dict__["_UpLook__executors"][key] = executor
+        self.__dict__["_UpLook__hints"][key] = Hints(latency, batch, concurrency, pure)
+        functions = []
+        self.value = self.__build(self.__kwargs, functions)
+        self.__user_defined_functions = functions
         self.__dict__["_UpLook__lock"] = True
+
+    def reload(self, **kwargs):
+
+        """
+        Replaces the current values with <kwargs>.
+
+        Lookup definitions which are unchanged compared to the current kwargs
+        keep their already resolved value.  Only added or changed lookup
+        definitions are resolved.  The new values only replace the current
+        ones once all of them have been resolved successfully.
+
+        Any layers are replaced by <kwargs> as the one and only layer.
+        """
+
+        self.updateLayers(kwargs)
+
+    def updateLayer(self, number, layer):
+
+        """
+        Replaces layer with index <number> by <layer> and reloads the merged
+        result.
+
+        :param number: The index of the layer to replace.
+        :type number: int
+        :param layer: The new layer.
+        :type layer: dict
+        """
+
+        layers = list(self.__layers)
+        layers[number] = layer
+        self.updateLayers(*layers)
+
+    def updateLayers(self, *layers):
+
+        """
+        Replaces all layers by <layers> and reloads the merged result.
+
+        :param layers: One or more dicts.
+        :type layers: dict
+        """
+
+        layers = [self.__copyDicts(layer) for layer in layers]
+        kwargs, origin = self.__mergeLayers(layers)
+
+        functions = []
+        value = self.__build(kwargs, functions, self.__kwargs, self.value)
+
+        self.__dict__["_UpLook__lock"] = False
+        self.__user_defined_functions = functions
+        self.__kwargs = kwargs
+        self.__layers = layers
+        self.__origin = origin
+        self.value = value
+        self.__dict__["_UpLook__lock"] = True
+
+    def getOrigin(self, path):
+
+        """
+        Returns the index of the layer providing the value of <path>.
+
+        :param path: The dotted path of the value. For example "db.host".
+        :type path: str or unicode
+        :rtype: int
+        """
+
+        try:
+            return self.__origin[path]
+        except KeyError:
+            raise NoSuchValue("'%s' is an unknown value." % (path))
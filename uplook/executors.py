@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  executors.py
+#
+#  Copyright 2015 Jelle Smet <development@smetj.net>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+import pickle
+
+pools = {}
+pools_lock = Lock()
+
+
+def getExecutor(executor):
+
+    """
+    Returns the executor to run lookup functions on.
+
+    "process" and "thread" return a process or thread pool shared by all
+    UpLook instances.  Any other object is expected to have a
+    concurrent.futures.Executor compatible submit() method and is returned
+    as is.
+
+    :param executor: "process", "thread" or an executor instance.
+    :rtype: concurrent.futures.Executor
+    """
+
+    if executor == "process":
+        return getPool(executor, ProcessPoolExecutor)
+    elif executor == "thread":
+        return getPool(executor, ThreadPoolExecutor)
+    elif hasattr(executor, "submit"):
+        return executor
+    else:
+        raise Exception("'%s' is not a valid executor." % (executor))
+
+
+def checkFunction(executor, function):
+
+    """
+    Verifies whether <function> can be executed on <executor>.  Functions
+    executed on a process pool need to be picklable.
+
+    :param executor: concurrent.futures.Executor
+    :param function: The lookup function.
+    :type function: function
+    """
+
+    if isinstance(executor, ProcessPoolExecutor):
+        try:
+            pickle.dumps(function)
+        except Exception as err:
+            raise Exception("Function '%s' can not be executed on a process pool since it can not be pickled. Reason: %s" % (getattr(function, "__name__", function), err))
+
+
+def getPool(name, cls):
+
+    with pools_lock:
+        if name not in pools:
+            pools[name] = cls()
+        return pools[name]
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  planner.py
+#
+#  Copyright 2015 Jelle Smet <development@smetj.net>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+
+MAX_WORKERS = 32
+
+# Functions with a lower latency hint are executed inline.
+INLINE_LATENCY = 0.01
+
+# latency:     The expected number of seconds a call takes.
+# batch:       Whether the function accepts a list of references and returns
+#              a list of values in the same order.
+# concurrency: The maximum number of concurrent calls.
+# pure:        Whether the function is side-effect free so identical
+#              lookups can share one call.
+Hints = namedtuple("Hints", ["latency", "batch", "concurrency", "pure"])
+DEFAULT_HINTS = Hints(None, False, None, False)
+
+
+class Outcome(object):
+
+    """
+    The value returned or the error raised by a call and the number of
+    seconds the call took.
+    """
+
+    def __init__(self, value=None, error=None, latency=None):
+
+        self.value = value
+        self.error = error
+        self.latency = latency
+
+    def get(self):
+
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def execute(call):
+
+    start = time.perf_counter()
+    try:
+        outcome = Outcome(value=call())
+    except Exception as err:
+        outcome = Outcome(error=err)
+    outcome.latency = time.perf_counter() - start
+    return outcome
+
+
+def unpackBatch(function, values, count):
+
+    """
+    Returns an Outcome per reference out of the <values> returned by batch
+    lookup function <function>.  Values which are an Exception count as that
+    lookup failing.
+
+    :param function: The function name.
+    :param values: The values returned by the batch lookup function.
+    :type values: list
+    :param count: The number of references passed to the function.
+    :type count: int
+    :rtype: list of Outcome
+    """
+
+    values = list(values)
+    if len(values) != count:
+        raise Exception("Batch lookup function '%s' returned %s values for %s references." % (function, len(values), count))
+
+    result = []
+    for value in values:
+        if isinstance(value, Exception):
+            result.append(Outcome(error=value))
+        else:
+            result.append(Outcome(value=value))
+    return result
+
+
+def plan(jobs, hints, call, concurrent=(), group=True):
+
+    """
+    Executes <jobs> ordered, grouped and parallelized according to the hints
+    of their functions.
+
+    Functions with a latency hint of INLINE_LATENCY or more or which are
+    part of <concurrent> are started first and run concurrently, at most
+    <concurrency> calls at a time, slowest function first.  All other
+    functions are executed inline while those are running, cheapest function
+    first.  Functions without latency hint count as a latency of 0.
+
+    When <group> is True, identical lookups of pure functions share one call
+    and lookups of batch functions with a reference are executed in one call.
+
+    :param jobs: A list of (function name, args) tuples.
+    :type jobs: list
+    :param hints: Maps function names to their Hints.
+    :type hints: dict
+    :param call: Called with the function name followed by the args.
+    :type call: function
+    :param concurrent: Function names which always run concurrently.
+    :param group: Whether to apply the pure and batch hints.
+    :type group: bool
+    :rtype: list of Outcome, one for each job
+    """
+
+    functions = {}
+    for index, (function, args) in enumerate(jobs):
+        functions.setdefault(function, []).append((index, args))
+
+    inline = []
+    lanes = []
+    for function in sorted(functions, key=lambda function: hints.get(function, DEFAULT_HINTS).latency or 0):
+        function_hints = hints.get(function, DEFAULT_HINTS)
+        items = generateItems(function, functions[function], function_hints, call, group)
+
+        if (function_hints.latency or 0) >= INLINE_LATENCY or function in concurrent:
+            count = min(function_hints.concurrency or len(items), len(items))
+            lanes = [items[number::count] for number in range(count)] + lanes
+        else:
+            inline += items
+
+    outcomes = [None] * len(jobs)
+
+    def run(items):
+
+        for item in items:
+            for indices, outcome in item():
+                for index in indices:
+                    outcomes[index] = outcome
+
+    if lanes:
+        with ThreadPoolExecutor(max_workers=min(len(lanes), MAX_WORKERS)) as pool:
+            futures = [pool.submit(copy_context().run, run, lane) for lane in lanes]
+            run(inline)
+            for future in futures:
+                future.result()
+    else:
+        run(inline)
+
+    return outcomes
+
+
+def generateItems(function, jobs, hints, call, group):
+
+    """
+    Returns the work items for the <jobs> of one function.  Each item returns
+    a list of (job indices, Outcome) tuples.
+
+    :param function: The function name.
+    :param jobs: A list of (index, args) tuples.
+    :param hints: The Hints of the function.
+    :param call: See plan().
+    :param group: See plan().
+    :rtype: list of functions
+    """
+
+    units = []
+    if group and hints.pure:
+        shared = {}
+        for index, args in jobs:
+            if args in shared:
+                shared[args].append(index)
+            else:
+                shared[args] = [index]
+                units.append((args, shared[args]))
+    else:
+        units = [(args, [index]) for index, args in jobs]
+
+    def single(args, indices):
+
+        return lambda: [(indices, execute(lambda: call(function, *args)))]
+
+    def batch(units):
+
+        def item():
+            outcome = execute(lambda: unpackBatch(function, call(function, [args[0] for args, _ in units]), len(units)))
+            if outcome.error is not None:
+                return [(indices, outcome) for _, indices in units]
+
+            for value in outcome.value:
+                value.latency = outcome.latency
+            return [(indices, value) for (_, indices), value in zip(units, outcome.value)]
+
+        return item
+
+    if group and hints.batch:
+        batched = [unit for unit in units if len(unit[0]) == 1]
+        items = [single(args, indices) for args, indices in units if len(args) != 1]
+        if batched:
+            items.append(batch(batched))
+        return items
+    else:
+        return [single(args, indices) for args, indices in units]
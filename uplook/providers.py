@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  providers.py
+#
+#  Copyright 2015 Jelle Smet <development@smetj.net>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import os
+import json
+from .errors import NoSuchValue
+
+
+class FileCache(object):
+
+    """
+    Keeps the parsed content of files and only reads a file again when its
+    mtime, size or inode changes.
+
+    :param parser: A function which converts the file content into a value.
+    :type parser: function
+    """
+
+    def __init__(self, parser):
+
+        self.parser = parser
+        self.__cache = {}
+
+    def get(self, path):
+
+        """
+        Returns the parsed content of <path>.
+
+        :param path: The path of the file.
+        :type path: str or unicode
+        """
+
+        try:
+            stat = os.stat(path)
+        except OSError as err:
+            raise NoSuchValue("'%s' can not be read. Reason: %s" % (path, err))
+
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        cached = self.__cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with open(path) as f:
+            value = self.parser(f.read())
+        self.__cache[path] = (signature, value)
+        return value
+
+
+def stripNewline(data):
+
+    return data.rstrip("\r\n")
+
+
+text_files = FileCache(stripNewline)
+json_files = FileCache(json.loads)
+
+
+def readFile(path):
+
+    """
+    Returns the content of file <path> without trailing newline.
+
+    :param path: The path of the file.
+    :type path: str or unicode
+    """
+
+    return text_files.get(path)
+
+
+def readJSON(reference):
+
+    """
+    Returns the value of a JSON file.
+
+    The reference has format <path>#<dotted.key>.  When the #<dotted.key>
+    part is omitted the complete JSON document is returned.
+
+    :param reference: The path of the file and optionally the dotted key.
+    :type reference: str or unicode
+    """
+
+    path, _, key = reference.partition("#")
+    value = json_files.get(path)
+
+    if key == "":
+        return value
+
+    for part in key.split("."):
+        try:
+            if isinstance(value, list):
+                value = value[int(part)]
+            else:
+                value = value[part]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise NoSuchValue("'%s' is an unknown value in '%s'." % (key, path))
+    return value
+
+
+def readEnv(name):
+
+    """
+    Returns the value of environment variable <name>.
+
+    :param name: The name of the environment variable.
+    :type name: str or unicode
+    """
+
+    try:
+        return os.environ[name]
+    except KeyError:
+        raise NoSuchValue("Environment variable '%s' is not set." % (name))
+
+
+BUILTIN_LOOKUPS = {"file": readFile,
+                   "json": readJSON,
+                   "env": readEnv
+                   }
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#  trace.py
+#
+#  Copyright 2015 Jelle Smet <development@smetj.net>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+
+import os
+import sys
+from collections import namedtuple
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+Record = namedtuple("Record", ["path", "function", "reference", "latency", "outcome", "caller"])
+CallSite = namedtuple("CallSite", ["caller", "count", "latency", "paths"])
+
+
+class Trace(object):
+
+    """
+    Keeps a Record of each dynamic lookup executed while tracing.
+
+    The outcome of a Record is one of:
+
+        - "value": The lookup function returned a value.
+        - "default": The lookup function failed and the default value was returned.
+        - "cache": The value was memoized within the current scope.
+        - "error": The lookup function failed and no default value was set.
+
+    The caller of a Record is a (filename, line number, function name) tuple
+    of the first frame outside the uplook package.
+    """
+
+    def __init__(self):
+
+        self.records = []
+
+    def record(self, path, function, reference, latency, outcome):
+
+        """
+        Adds a Record for a dynamic lookup which has just been executed.
+
+        :param path: The dotted path of the value.
+        :type path: str or unicode
+        :param function: The reference name of the function.
+        :type function: str or unicode
+        :param reference: The variable name which has been looked up.
+        :param latency: The number of seconds the lookup took.
+        :type latency: float
+        :param outcome: "value", "default", "cache" or "error"
+        :type outcome: str
+        """
+
+        self.records.append(Record(path, function, reference, latency, outcome, getCaller()))
+
+    def report(self):
+
+        """
+        Returns a CallSite per caller sorted by the number of lookups and
+        their total latency, the hottest call site first.
+
+        :rtype: list of CallSite
+        """
+
+        sites = {}
+        for record in self.records:
+            count, latency, paths = sites.get(record.caller, (0, 0.0, set()))
+            paths.add(record.path)
+            sites[record.caller] = (count + 1, latency + record.latency, paths)
+
+        result = [CallSite(caller, count, latency, sorted(paths)) for caller, (count, latency, paths) in sites.items()]
+        return sorted(result, key=lambda site: (site.count, site.latency), reverse=True)
+
+
+def getCaller():
+
+    """
+    Returns a (filename, line number, function name) tuple of the first frame
+    outside the uplook package.
+    """
+
+    frame = sys._getframe(1)
+    while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == PACKAGE_DIR:
+        frame = frame.f_back
+
+    if frame is None:
+        return (None, None, None)
+    else:
+        return (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)